@@ -1,12 +1,20 @@
 #!/usr/bin/env python3
 
+import array
+import ctypes
+import math
+import mmap
 import sys
 import time
 import usb.core
 import usb.util
 import usb.backend.libusb1
+try:
+    import usb1
+    from usb1 import libusb1
+except ImportError:
+    usb1 = None
 from dataclasses import dataclass
-from typing import Optional, List, Dict, Tuple
 
 class VENDOR:
     MICROSOFT = 0x045E
@@ -36,55 +44,113 @@ class PROTOCOL:
     HID     = "HID"
     UNKNOWN = "Unknown"
 
+def hex_str(data: bytes) -> str:
+    return (data if isinstance(data, (bytes, bytearray)) else bytes(data)).hex(' ').upper()
+
+def _packet(*values: int) -> tuple[bytes, str]:
+    pkt = bytes(values)
+    return pkt, hex_str(pkt)
+
 INIT_PACKETS = {
     PROTOCOL.GIP: [
-        bytes([0x05, 0x20, 0x00, 0x01, 0x00]),
-        bytes([0x0A, 0x20, 0x00, 0x03, 0x00, 0x01, 0x14]),
-        bytes([0x06, 0x20, 0x00, 0x02, 0x01, 0x00]),
+        _packet(0x05, 0x20, 0x00, 0x01, 0x00),
+        _packet(0x0A, 0x20, 0x00, 0x03, 0x00, 0x01, 0x14),
+        _packet(0x06, 0x20, 0x00, 0x02, 0x01, 0x00),
     ],
     PROTOCOL.PS4: [
-        bytes([0x05, 0xFF, 0x05, 0x00, 0x01, 0x00]),
+        _packet(0x05, 0xFF, 0x05, 0x00, 0x01, 0x00),
     ],
     PROTOCOL.SWITCH: [
-        bytes([0x80, 0x02]),
+        _packet(0x80, 0x02),
     ]
 }
 
 OUTPUT_TEST_PACKETS = {
-    PROTOCOL.GIP:    bytes([0x09, 0x09, 0xFF, 0xFF, 0xFF, 0x00, 0x00, 0x00, 0x00, 0x00]), # Rumble/LED
-    PROTOCOL.PS4:    bytes([0x05, 0xFF, 0x05, 0x00, 0x01, 0x00]), # LED
-    PROTOCOL.SWITCH: bytes([0x80, 0x02]), # LED
+    PROTOCOL.GIP:    _packet(0x09, 0x09, 0xFF, 0xFF, 0xFF, 0x00, 0x00, 0x00, 0x00, 0x00), # Rumble/LED
+    PROTOCOL.PS4:    _packet(0x05, 0xFF, 0x05, 0x00, 0x01, 0x00), # LED
+    PROTOCOL.SWITCH: _packet(0x80, 0x02), # LED
+}
+
+_VID_TO_PROTOCOL = {
+    VENDOR.GAMESIR:   PROTOCOL.GIP,
+    VENDOR.MICROSOFT: PROTOCOL.GIP,
+    VENDOR.SONY:      PROTOCOL.PS4,
+    VENDOR.NINTENDO:  PROTOCOL.SWITCH,
 }
 
-CONFIG = {
-    'READ_TIMEOUT': 100,
-    'WRITE_TIMEOUT': 100,
-    'MONITOR_DURATION_SEC': 5,
-    'MAX_REPORTS': 20,
-    'INIT_DELAY_SEC': 0.05,
-    'POWER_UNIT_MA': 2,
-    'EP_DIR_MASK': 0x80,
-    'EP_ATTR_MASK': 0x03,
+_PROTOCOL_BUNDLE = {
+    p: (INIT_PACKETS.get(p, ()), OUTPUT_TEST_PACKETS.get(p))
+    for p in (PROTOCOL.GIP, PROTOCOL.PS4, PROTOCOL.SWITCH, PROTOCOL.HID, PROTOCOL.UNKNOWN)
 }
 
+@dataclass(frozen=True, slots=True)
+class Config:
+    READ_TIMEOUT: int = 5
+    WRITE_TIMEOUT: int = 100
+    MONITOR_DURATION_SEC: int = 5
+    MAX_REPORTS: int = 20
+    INIT_DELAY_SEC: float = 0.05
+    POWER_UNIT_MA: int = 2
+    EP_DIR_MASK: int = 0x80
+    EP_ATTR_MASK: int = 0x03
+    ASYNC_TRANSFERS: int = 8
+
+CONFIG = Config()
+
+TARGET_VENDORS: frozenset[int] = frozenset(
+    value for key, value in vars(VENDOR).items() if isinstance(value, int) and not key.startswith('_')
+)
+GAMEPAD_CLASSES: frozenset[int] = frozenset({USB_CLASS.HID, USB_CLASS.VENDOR_SPEC})
+
+_STR_CACHE: dict[tuple[int, int, int, int], str] = {}
+
 def get_string_safe(dev, index) -> str:
     if not index: return ""
-    try: return usb.util.get_string(dev, index)
-    except: return "<Unreadable>"
+    key = (dev.bus, dev.address, dev.idVendor, index)
+    cached = _STR_CACHE.get(key)
+    if cached is not None: return cached
+    try: value = usb.util.get_string(dev, index)
+    except (usb.core.USBError, ValueError, UnicodeDecodeError): return "<Unreadable>"
+    _STR_CACHE[key] = value
+    return value
+
+def poll_interval_ms(speed, interval: int) -> float:
+    # bInterval counts 1 ms frames below high speed, and is an exponent of 125 us microframes from high speed up
+    if interval and (speed or 0) >= usb.util.SPEED_HIGH:
+        return 2 ** (interval - 1) / 8
+    return float(interval)
+
+def alloc_transfer_buffer(handle, size: int):
+    # Linux libusb >= 1.0.21 can hand out usbfs mmap'd memory, saving the kernel->user copy per transfer
+    if sys.platform.startswith('linux'):
+        try:
+            raw = handle._USBDeviceHandle__handle
+            alloc = ctypes.CFUNCTYPE(ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t)(('libusb_dev_mem_alloc', libusb1.libusb))
+            free = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t)(('libusb_dev_mem_free', libusb1.libusb))
+        except AttributeError:
+            pass
+        else:
+            ptr = alloc(raw, size)
+            if ptr:
+                return (ctypes.c_ubyte * size).from_address(ptr), lambda: free(raw, ptr, size)
 
-def hex_str(data: bytes) -> str:
-    return " ".join(f"{b:02X}" for b in data)
+    buf = mmap.mmap(-1, size)
+    return buf, buf.close
 
 class GamepadAnalyzer:
+    __slots__ = ('dev', 'vid', 'pid', 'info', 'protocol', 'endpoints', 'in_max_pkt', 'in_interval_ms')
+
     def __init__(self, device):
         self.dev = device
         self.vid = device.idVendor
         self.pid = device.idProduct
         self.info = self._collect_info()
         self.protocol = self._detect_protocol()
-        self.endpoints = {'in': None, 'out': None}
+        self.endpoints = [None, None]  # [out, in]
+        self.in_max_pkt = 0
+        self.in_interval_ms = 0.0
 
-    def _collect_info(self) -> Dict:
+    def _collect_info(self) -> dict:
         return {
             'mfg': get_string_safe(self.dev, self.dev.iManufacturer),
             'prod': get_string_safe(self.dev, self.dev.iProduct),
@@ -92,17 +158,18 @@ class GamepadAnalyzer:
         }
 
     def _detect_protocol(self) -> str:
-        if self.vid in (VENDOR.GAMESIR, VENDOR.MICROSOFT): return PROTOCOL.GIP
-        if self.vid == VENDOR.SONY: return PROTOCOL.PS4
-        if self.vid == VENDOR.NINTENDO: return PROTOCOL.SWITCH
-        if self.dev.bDeviceClass == USB_CLASS.HID: return PROTOCOL.HID
-        return PROTOCOL.UNKNOWN
+        return _VID_TO_PROTOCOL.get(self.vid) or (
+            PROTOCOL.HID if self.dev.bDeviceClass == USB_CLASS.HID else PROTOCOL.UNKNOWN
+        )
 
     def analyze_structure(self):
-        print(f"\n[DEVICE] {self.info['prod']} ({self.info['mfg']})")
-        print(f"  ID: {self.vid:04X}:{self.pid:04X} | Serial: {self.info['serial']}")
-        print(f"  System: Class:0x{self.dev.bDeviceClass:02X} Sub:0x{self.dev.bDeviceSubClass:02X} Proto:0x{self.dev.bDeviceProtocol:02X}")
-        print(f"  Detection: {self.protocol}")
+        parts = [
+            f"\n[DEVICE] {self.info['prod']} ({self.info['mfg']})",
+            f"  ID: {self.vid:04X}:{self.pid:04X} | Serial: {self.info['serial']}",
+            f"  System: Class:0x{self.dev.bDeviceClass:02X} Sub:0x{self.dev.bDeviceSubClass:02X} Proto:0x{self.dev.bDeviceProtocol:02X}",
+            f"  Detection: {self.protocol}",
+        ]
+        emit = parts.append
 
         try:
             try:
@@ -111,26 +178,35 @@ class GamepadAnalyzer:
                 pass
 
             cfg = self.dev.get_active_configuration()
-            print(f"  Config: #{cfg.bConfigurationValue} | Power: {cfg.bMaxPower * CONFIG['POWER_UNIT_MA']}mA")
+            emit(f"  Config: #{cfg.bConfigurationValue} | Power: {cfg.bMaxPower * CONFIG.POWER_UNIT_MA}mA")
+
+            dir_mask = CONFIG.EP_DIR_MASK
+            attr_mask = CONFIG.EP_ATTR_MASK
+            ep_names = EP_TYPE.NAMES
+            intr = EP_TYPE.INTERRUPT
 
             for intf in cfg:
-                print(f"  [Interface {intf.bInterfaceNumber}] Class: 0x{intf.bInterfaceClass:02X} ({'HID' if intf.bInterfaceClass==USB_CLASS.HID else 'Other'})")
+                emit(f"  [Interface {intf.bInterfaceNumber}] Class: 0x{intf.bInterfaceClass:02X} ({'HID' if intf.bInterfaceClass==USB_CLASS.HID else 'Other'})")
 
                 for ep in intf:
                     addr = ep.bEndpointAddress
                     attr = ep.bmAttributes
-                    is_in = (addr & CONFIG['EP_DIR_MASK'])
-                    ep_type = EP_TYPE.NAMES.get(attr & CONFIG['EP_ATTR_MASK'], "Unknown")
+                    idx = (addr & dir_mask) >> 7
+                    ep_type = ep_names.get(attr & attr_mask, "Unknown")
 
-                    print(f"    {'IN ' if is_in else 'OUT'} 0x{addr:02X} | {ep_type:11} | MaxPkt: {ep.wMaxPacketSize}")
+                    emit(f"    {'IN ' if idx else 'OUT'} 0x{addr:02X} | {ep_type:11} | MaxPkt: {ep.wMaxPacketSize}")
 
-                    direction = 'in' if is_in else 'out'
-                    is_interrupt = (attr & CONFIG['EP_ATTR_MASK']) == EP_TYPE.INTERRUPT
-                    if is_interrupt or self.endpoints[direction] is None:
-                        self.endpoints[direction] = addr
+                    is_interrupt = (attr & attr_mask) == intr
+                    if is_interrupt or self.endpoints[idx] is None:
+                        self.endpoints[idx] = addr
+                        if idx:
+                            self.in_max_pkt = ep.wMaxPacketSize
+                            self.in_interval_ms = poll_interval_ms(self.dev.speed, ep.bInterval) if is_interrupt else 0.0
 
         except usb.core.USBError as e:
-            print(f"  [ERROR] Structure analysis failed: {e}")
+            emit(f"  [ERROR] Structure analysis failed: {e}")
+        finally:
+            sys.stdout.write("\n".join(parts) + "\n")
 
     def connect_and_test(self):
         if not self._claim_interface():
@@ -163,69 +239,185 @@ class GamepadAnalyzer:
             return False
 
     def _run_init(self):
-        ep = self.endpoints['out']
-        pkts = INIT_PACKETS.get(self.protocol, [])
+        ep = self.endpoints[0]
+        pkts, _ = _PROTOCOL_BUNDLE[self.protocol]
         if not pkts or not ep: return
 
         print(f"\n[INIT] Sending {self.protocol} Handshake ({len(pkts)} packets)...")
-        for i, pkt in enumerate(pkts, 1):
+        # Pace writes on a fixed period so time spent in write() counts towards the inter-packet delay
+        next_ts = time.monotonic()
+        for i, (pkt, pkt_hex) in enumerate(pkts, 1):
+            now = time.monotonic()
+            if now < next_ts: time.sleep(next_ts - now)
             try:
-                self.dev.write(ep, pkt, timeout=CONFIG['WRITE_TIMEOUT'])
-                print(f"  -> ({i}/{len(pkts)}) Sent: {hex_str(pkt)}")
-                time.sleep(CONFIG['INIT_DELAY_SEC'])
+                self.dev.write(ep, pkt, timeout=CONFIG.WRITE_TIMEOUT)
+                print(f"  -> ({i}/{len(pkts)}) Sent: {pkt_hex}")
             except usb.core.USBError as e:
                 print(f"  -> ({i}/{len(pkts)}) ALERT: Write failed - {e}")
+            next_ts += CONFIG.INIT_DELAY_SEC
+
+        now = time.monotonic()
+        if now < next_ts: time.sleep(next_ts - now)
 
     def _test_output(self):
-        ep = self.endpoints['out']
-        pkt = OUTPUT_TEST_PACKETS.get(self.protocol)
-        if not pkt or not ep: return
+        ep = self.endpoints[0]
+        _, entry = _PROTOCOL_BUNDLE[self.protocol]
+        if not entry or not ep: return
+        pkt, pkt_hex = entry
 
         print(f"\n[OUTPUT] Testing Feedback (Rumble/LED)...")
         try:
-            self.dev.write(ep, pkt, timeout=CONFIG['WRITE_TIMEOUT'])
-            print(f"  -> Sent: {hex_str(pkt)}")
+            self.dev.write(ep, pkt, timeout=CONFIG.WRITE_TIMEOUT)
+            print(f"  -> Sent: {pkt_hex}")
         except usb.core.USBError as e:
             print(f"  -> ALERT: Write failed - {e}")
 
     def _monitor_input(self):
-        ep = self.endpoints['in']
+        ep = self.endpoints[1]
         if not ep:
             print("\n[INPUT] No IN endpoint found, skipping...")
             return
 
-        print(f"\n[INPUT] Monitoring {CONFIG['MAX_REPORTS']} reports (Ctrl+C to stop)...")
+        print(f"\n[INPUT] Monitoring {CONFIG.MAX_REPORTS} reports (Ctrl+C to stop)...")
+        count = self._monitor_input_async(ep) if usb1 else None
+        if count is None:
+            count = self._monitor_input_sync(ep)
+
+        if count == 0:
+            print("  -> No reports received (Try pressing buttons)")
+
+    def _monitor_input_sync(self, ep: int) -> int:
         count = 0
-        start = time.time()
+        max_reports = CONFIG.MAX_REPORTS
+        # Assumes the device sends at most one report per poll interval; two periods leave room for host jitter
+        timeout = max(CONFIG.READ_TIMEOUT, math.ceil(2 * self.in_interval_ms))
+        read = self.dev.read
+        read_size = self.in_max_pkt or 64
+        buf = array.array('B', bytes(read_size))
+        usb_error = usb.core.USBError
+        monotonic_ns = time.monotonic_ns
+        start_ns = monotonic_ns()
+        deadline_ns = start_ns + int(CONFIG.MONITOR_DURATION_SEC * 1_000_000_000)
 
         try:
-            while count < CONFIG['MAX_REPORTS'] and (time.time() - start) < CONFIG['MONITOR_DURATION_SEC']:
+            while count < max_reports and monotonic_ns() < deadline_ns:
                 try:
-                    data = self.dev.read(ep, 64, timeout=CONFIG['READ_TIMEOUT'])
-                    print(f"  [{time.time()-start:5.3f}s] < {hex_str(data)}")
-                    count += 1
-                except usb.core.USBError:
-                    pass
+                    n = read(ep, buf, timeout=timeout)
+                except usb_error:
+                    continue
+                elapsed = (monotonic_ns() - start_ns) * 1e-9
+                print(f"  [{elapsed:5.3f}s] < {hex_str(buf[:n])}")
+                count += 1
         except KeyboardInterrupt:
             pass
+        return count
 
-        if count == 0:
-            print("  -> No reports received (Try pressing buttons)")
+    def _open_usb1(self, context):
+        for dev in context.getDeviceIterator(skip_on_error=True):
+            if dev.getBusNumber() == self.dev.bus and dev.getDeviceAddress() == self.dev.address:
+                return dev.open()
+        return None
+
+    def _monitor_input_async(self, ep: int):
+        # usbfs claims are per handle, so hand interface 0 over to libusb1 for the capture
+        try: usb.util.release_interface(self.dev, 0)
+        except usb.core.USBError: return None
+
+        count = 0
+        max_reports = CONFIG.MAX_REPORTS
+        read_size = self.in_max_pkt or 64
+        monotonic_ns = time.monotonic_ns
+        start_ns = monotonic_ns()
+        deadline_ns = start_ns + int(CONFIG.MONITOR_DURATION_SEC * 1_000_000_000)
+        stopping = False
+
+        def on_transfer(transfer):
+            nonlocal count
+            status = transfer.getStatus()
+            if status == usb1.TRANSFER_COMPLETED and count < max_reports:
+                n = transfer.getActualLength()
+                elapsed = (monotonic_ns() - start_ns) * 1e-9
+                print(f"  [{elapsed:5.3f}s] < {hex_str(memoryview(transfer.getBuffer())[:n])}")
+                count += 1
+            if stopping or count >= max_reports: return
+            if status in (usb1.TRANSFER_COMPLETED, usb1.TRANSFER_TIMED_OUT):
+                try: transfer.submit()
+                except usb1.USBError: pass
+
+        context = usb1.USBContext()
+        handle = None
+        try:
+            # Opening the context loads libusb and may raise OSError when the library is missing
+            context.open()
+            handle = self._open_usb1(context)
+            if handle is None: raise usb1.USBErrorNotFound()
+            handle.claimInterface(0)
+        except (usb1.USBError, OSError) as e:
+            if handle is not None: handle.close()
+            context.close()
+            print(f"  [STATUS] Async capture unavailable ({e}), falling back to sync reads")
+            try: usb.util.claim_interface(self.dev, 0)
+            except usb.core.USBError as e:
+                print(f"  [ERROR] Could not reclaim interface: {e}")
+                return 0
+            return None
+
+        transfers = []
+        buffers = []
+        try:
+            for _ in range(CONFIG.ASYNC_TRANSFERS):
+                buf, free = alloc_transfer_buffer(handle, read_size)
+                buffers.append(free)
+                transfer = handle.getTransfer()
+                transfer.setInterrupt(ep, buf, callback=on_transfer)
+                transfer.submit()
+                transfers.append(transfer)
+
+            while count < max_reports and monotonic_ns() < deadline_ns:
+                context.handleEventsTimeout(0.1)
+        except usb1.USBError as e:
+            print(f"  [ERROR] Async capture stopped: {e}")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # Completions racing a cancel see the flag and are not resubmitted
+            stopping = True
+            while any(t.isSubmitted() for t in transfers):
+                for transfer in transfers:
+                    if not transfer.isSubmitted(): continue
+                    try: transfer.cancel()
+                    except usb1.USBError: pass
+                try: context.handleEventsTimeout(0.1)
+                except usb1.USBError: break
+            # A transfer still in flight here means event handling failed; leak it rather than free memory under it
+            if not any(t.isSubmitted() for t in transfers):
+                for transfer in transfers:
+                    transfer.close()
+                for free in buffers:
+                    free()
+            try: handle.releaseInterface(0)
+            except usb1.USBError: pass
+            handle.close()
+            context.close()
+        return count
 
     def close(self):
         try: usb.util.dispose_resources(self.dev)
-        except: pass
+        except (usb.core.USBError, AttributeError): pass
 
-def list_devices() -> List[usb.core.Device]:
-    found = []
-    target_vendors = {value for key, value in VENDOR.__dict__.items() if not key.startswith('_')}
+def list_devices() -> list[tuple[usb.core.Device, str]]:
+    found = [
+        dev for dev in usb.core.find(find_all=True)
+        if dev.bDeviceClass in GAMEPAD_CLASSES or dev.idVendor in TARGET_VENDORS
+    ]
+    if len(found) < 2:
+        return [(dev, get_string_safe(dev, dev.iProduct)) for dev in found]
 
-    for dev in usb.core.find(find_all=True):
-        is_gamepad_class = dev.bDeviceClass in (USB_CLASS.HID, USB_CLASS.VENDOR_SPEC)
-        is_known_vendor = dev.idVendor in target_vendors
-        if is_gamepad_class or is_known_vendor:
-            found.append(dev)
-    return found
+    # String descriptor reads are independent control transfers on distinct devices
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(8, len(found))) as ex:
+        names = list(ex.map(lambda d: get_string_safe(d, d.iProduct), found))
+    return list(zip(found, names))
 
 def main():
     if not usb.backend.libusb1.get_backend():
@@ -238,14 +430,13 @@ def main():
         sys.exit(0)
 
     print(f"\nFound {len(devices)} device(s):")
-    for i, d in enumerate(devices, 1):
-        name = get_string_safe(d, d.iProduct) or "Unknown Device"
-        print(f" {i}: {d.idVendor:04X}:{d.idProduct:04X} - {name}")
+    for i, (d, name) in enumerate(devices, 1):
+        print(f" {i}: {d.idVendor:04X}:{d.idProduct:04X} - {name or 'Unknown Device'}")
 
     try:
         sel = input(f"\nSelect device [1-{len(devices)}]: ")
         idx = int(sel) - 1
-        target = devices[idx]
+        target, _ = devices[idx]
     except (ValueError, IndexError):
         print("Invalid selection")
         sys.exit(1)